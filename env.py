@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Load the .env file once per process, when this module is first imported
+_ENV_LOADED = load_dotenv()
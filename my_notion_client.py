@@ -1,32 +1,81 @@
-from notion_client import Client
+from notion_client import AsyncClient
+from notion_client.errors import APIErrorCode, APIResponseError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+import httpx
+import logging
 import os
-from dotenv import load_dotenv
+from typing import Optional
+import env  # noqa: F401  Loads the .env file
 
 
+# The Notion API accepts at most 100 children per append request
+MAX_BLOCKS_PER_REQUEST = 100
+
+
+# Errors Notion reports before processing a request, so retrying can't append twice
+_RETRYABLE_CODES = {APIErrorCode.RateLimited, APIErrorCode.ServiceUnavailable}
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """
+    Whether a failed Notion request is safe to retry.
+
+    Appending children isn't idempotent, so only rate limiting and
+    service_unavailable are retried. Timeouts and other server errors may
+    come after the append was applied and are not retried. Neither are
+    non-JSON gateway errors, which are raised as UnknownHTTPResponseError
+    and say nothing about whether the request was processed.
+    """
+    return isinstance(error, APIResponseError) and error.code in _RETRYABLE_CODES
 
 
 class NotionClientWrapper:
-    def __init__(self):
+    def __init__(self, auth: Optional[str] = None, page_id: Optional[str] = None):
         """
         Initialize the Notion client.
+
+        Args:
+            auth (str, optional): The Notion integration token. Defaults to $NOTION_TOKEN.
+            page_id (str, optional): The page to append blocks to. Defaults to $NOTION_PAGE_ID.
         """
-        load_dotenv()
-        self.client = Client(auth=os.environ["NOTION_TOKEN"])
-        self.PAGE_ID = os.environ["NOTION_PAGE_ID"]
+        # A single pooled HTTP client so connections are kept alive across appends
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10))
+        self.client = AsyncClient(auth=auth or os.environ["NOTION_TOKEN"], client=self._http)
+        self.PAGE_ID = page_id or os.environ["NOTION_PAGE_ID"]
 
-    def append_custom_blocks_to_page(self, blocks: list):
+    @retry(wait=wait_exponential_jitter(1, 30), stop=stop_after_attempt(5),
+           retry=retry_if_exception(_is_retryable), reraise=True)
+    async def _append_children(self, children: list):
         """
-        Appends custom blocks to an existing Notion page.
+        Appends a single request's worth of blocks, retrying transient failures.
+        """
+        await self.client.blocks.children.append(
+            block_id=self.PAGE_ID,
+            children=children
+        )
+
+    async def append_custom_blocks_to_page(self, blocks: list):
+        """
+        Appends custom blocks to an existing Notion page, in order, using as
+        few requests as the API allows.
 
         Args:
             blocks (list): A list of Notion block objects with specific formatting and content.
+
+        Raises:
+            Exception: The error of the first request that failed after retries.
         """
         try:
-            self.client.blocks.children.append(
-                block_id=self.PAGE_ID,
-                children=blocks
-            )
-            print(f"Added custom blocks to page: {self.PAGE_ID}")
-        except Exception as e:
-            print(f"Error while adding blocks: {e}")
-            
\ No newline at end of file
+            for start in range(0, len(blocks), MAX_BLOCKS_PER_REQUEST):
+                await self._append_children(blocks[start:start + MAX_BLOCKS_PER_REQUEST])
+        except Exception:
+            logging.exception("Error while adding blocks to page: %s", self.PAGE_ID)
+            raise
+        logging.info("Added %d custom blocks to page: %s", len(blocks), self.PAGE_ID)
+
+    async def close(self):
+        """
+        Close the underlying HTTP connection pool.
+        """
+        await self._http.aclose()
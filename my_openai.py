@@ -1,50 +1,383 @@
-from openai import OpenAI
+import asyncio
+import hashlib
+import httpx
+import ijson
+import json
+from openai import AsyncOpenAI
 import os
 import logging
-from dotenv import load_dotenv
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+import env  # noqa: F401  Loads the .env file
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
+class _StreamReader:
+    """
+    Async file-like view over streamed response text, consumed by ijson.
+    """
+
+    def __init__(self, pieces: AsyncIterator[str]):
+        self._pieces = pieces
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson probes with read(0) to detect bytes vs. str
+        if size == 0:
+            return b""
+        async for piece in self._pieces:
+            return piece.encode()
+        return b""
+
+
 class OpenAIClient:
-    def __init__(self, model="gpt-4o"):
+    def __init__(self, model="gpt-4o", api_key: Optional[str] = None):
         """
         Initialize the OpenAI client with a specified model.
+
+        Args:
+            model (str): The model to query.
+            api_key (str, optional): The OpenAI API key. Defaults to $OPENAI_KEY.
         """
-        load_dotenv()
-        
         # OpenAI.api_key = os.environ.get("OPENAI_KEY")
         # print(os.environ["OPENAI_KEY"])
-        self.client = OpenAI(api_key=os.environ["OPENAI_KEY"])
+        # A single pooled HTTP client so connections are kept alive across queries
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32,
+                                keepalive_expiry=120.0),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key or os.environ["OPENAI_KEY"], http_client=self._http)
         self.model = model
+        # Responses to deterministic (temperature 0) queries are cached on disk
+        self._cache_dir = Path(os.environ.get("OPENAI_CACHE", ".openai_cache"))
+
+    async def close(self) -> None:
+        """
+        Close the underlying HTTP connection pool.
+        """
+        await self._http.aclose()
 
-    def query(self, system_message: str, user_message: str) -> str:
+    def _cache_path(self, system_message: str, user_message: str,
+                    response_format: Optional[dict] = None) -> Path:
+        """
+        Return the cache file path for a (model, system, user, response format) combination.
+        """
+        key_text = f"{self.model}\x1f{system_message}\x1f{user_message}"
+        if response_format is not None:
+            key_text += "\x1f" + json.dumps(response_format, sort_keys=True)
+        key = hashlib.sha256(key_text.encode()).hexdigest()
+        return self._cache_dir / key[:2] / key
+
+    def _write_cache(self, path: Path, response: str) -> None:
+        """
+        Atomically write a response to the cache.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(response)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def query(self, system_message: str, user_message: str,
+                    temperature: Optional[float] = None, bypass_cache: bool = False,
+                    response_format: Optional[dict] = None) -> str:
         """
         Query the OpenAI model with a system message and a user message.
 
         Args:
             system_message (str): The role of the assistant, e.g., its behavior or capabilities.
             user_message (str): The prompt or query provided by the user.
+            temperature (float, optional): Sampling temperature; the API default is used if None.
+                Only queries with temperature 0 are served from / written to the cache.
+            bypass_cache (bool): If True, always query the API and don't write the cache.
+            response_format (dict, optional): Forwarded to the API, e.g. a json_schema
+                format to get structured output.
 
         Returns:
             str: The response content from the assistant.
         """
         # Log the prompts being sent to the model
-        logging.info(f"System Message: {system_message}")
-        logging.info(f"User Message: {user_message}")
+        _log_prompt(system_message, user_message)
+
+        use_cache = temperature == 0 and not bypass_cache
+        if use_cache:
+            cache_path = self._cache_path(system_message, user_message, response_format)
+            if cache_path.is_file():
+                response = cache_path.read_text(encoding="utf-8")
+                logging.info("Cached Response: %d chars", len(response))
+                logging.debug("Cached Response: %s", response)
+                return response
 
         # Query the OpenAI API
-        completion = self.client.chat.completions.create(
+        extra_args = _request_args(temperature, response_format)
+        completion = await self.client.chat.completions.create(
             model=self.model,
             messages=[
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_message},
-            ]
+            ],
+            **extra_args
         )
 
         # Extract and log the response
         response = completion.choices[0].message.content
-        logging.info(f"Model Response: {response}")
         if response is None:
             raise Exception("OpenAI API returned None")
-        return response
\ No newline at end of file
+        logging.info("Model Response: %d chars", len(response))
+        logging.debug("Model Response: %s", response)
+        if use_cache:
+            self._write_cache(cache_path, response)
+        return response
+
+    async def stream_items(self, system_message: str, user_message: str,
+                           temperature: Optional[float] = None,
+                           bypass_cache: bool = False,
+                           response_format: Optional[dict] = None,
+                           prefix: str = "item") -> AsyncIterator[dict]:
+        """
+        Stream a JSON response, yielding the elements of one of its arrays as
+        soon as each has been received.
+
+        Args:
+            system_message (str): The role of the assistant, e.g., its behavior or capabilities.
+            user_message (str): The prompt or query provided by the user.
+            temperature (float, optional): Sampling temperature, see query().
+            bypass_cache (bool): If True, always query the API and don't write the cache.
+            response_format (dict, optional): Forwarded to the API, see query().
+            prefix (str): The ijson prefix of the array elements to yield,
+                e.g. "ideas.item" for the elements of a top-level "ideas" array.
+
+        Yields:
+            dict: The parsed elements of the JSON array, one at a time.
+
+        Raises:
+            ijson.JSONError: If the response isn't valid JSON.
+        """
+        # Log the prompts being sent to the model
+        _log_prompt(system_message, user_message)
+
+        use_cache = temperature == 0 and not bypass_cache
+        if use_cache:
+            cache_path = self._cache_path(system_message, user_message, response_format)
+            if cache_path.is_file():
+                logging.info("Streaming cached response")
+                async for item in ijson.items(
+                        _StreamReader(_iter_text(cache_path.read_text(encoding="utf-8"))),
+                        prefix, use_float=True):
+                    yield item
+                return
+
+        # Query the OpenAI API
+        extra_args = _request_args(temperature, response_format)
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message},
+            ],
+            stream=True,
+            **extra_args
+        )
+
+        # The full text is only kept around when it has to be cached
+        parts = [] if use_cache else None
+
+        async def deltas() -> AsyncIterator[str]:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    if parts is not None:
+                        parts.append(content)
+                    yield content
+
+        async with stream:
+            async for item in ijson.items(_StreamReader(deltas()), prefix, use_float=True):
+                logging.debug("Streamed Item: %s", item)
+                yield item
+
+        if use_cache:
+            self._write_cache(cache_path, "".join(parts))
+
+    async def submit_batch(self, requests: List[dict]) -> str:
+        """
+        Submit chat completions through the Batch API, which is cheaper and has
+        separate rate limits but may take up to 24 hours to complete.
+
+        Args:
+            requests (list[dict]): One dict per completion with "custom_id",
+                "system_message" and "user_message", and optionally "temperature"
+                and "response_format" as accepted by query().
+
+        Returns:
+            str: The id of the created batch, to be passed to await_batch().
+        """
+        lines = []
+        for request in requests:
+            body = {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": request["system_message"]},
+                    {"role": "user", "content": request["user_message"]},
+                ],
+                **_request_args(request.get("temperature"), request.get("response_format")),
+            }
+            lines.append(json.dumps({
+                "custom_id": request["custom_id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }, ensure_ascii=False))
+
+        batch_file = await self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        logging.info("Submitted batch %s with %d requests", batch.id, len(requests))
+        return batch.id
+
+    async def await_batch(self, batch_id: str, poll_interval: float = 30.0) -> Dict[str, str]:
+        """
+        Wait for a batch to finish and collect its responses.
+
+        Args:
+            batch_id (str): The id returned by submit_batch().
+            poll_interval (float): Seconds to wait between status checks.
+
+        Returns:
+            dict: The response content keyed by custom_id. Requests that failed
+                are left out.
+        """
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelling", "cancelled"):
+                raise Exception(f"OpenAI batch {batch_id} ended with status {batch.status}")
+            logging.info("Batch %s is %s, waiting...", batch_id, batch.status)
+            await asyncio.sleep(poll_interval)
+
+        responses = {}
+        # No output file is created when every request in the batch failed
+        output_lines = []
+        if batch.output_file_id is not None:
+            output = await self.client.files.content(batch.output_file_id)
+            output_lines = output.text.splitlines()
+        for line in output_lines:
+            if not line:
+                continue
+            result = json.loads(line)
+            response = result.get("response")
+            if result.get("error") or not response or response["status_code"] != 200:
+                logging.error("Batch request %s failed: %s", result["custom_id"], result.get("error"))
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            if content is None:
+                logging.error("Batch request %s returned no content", result["custom_id"])
+                continue
+            responses[result["custom_id"]] = content
+
+        # Requests that failed inside a completed batch are only listed in the error file
+        if batch.error_file_id is not None:
+            errors = await self.client.files.content(batch.error_file_id)
+            for line in errors.text.splitlines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                logging.error("Batch request %s failed: %s", result.get("custom_id"),
+                              result.get("error") or response.get("body"))
+        return responses
+
+    async def batch_query(self, requests: List[dict], poll_interval: float = 30.0) -> Dict[str, str]:
+        """
+        Run completions through the Batch API, serving temperature 0 requests
+        from the response cache where possible and caching the new responses
+        that are valid JSON.
+
+        Args:
+            requests (list[dict]): As accepted by submit_batch(), optionally with
+                "bypass_cache" as accepted by query().
+            poll_interval (float): Seconds to wait between batch status checks.
+
+        Returns:
+            dict: The response content keyed by custom_id. Requests that failed
+                are left out.
+        """
+        responses = {}
+        cache_paths = {}
+        pending = []
+        for request in requests:
+            if request.get("temperature") == 0 and not request.get("bypass_cache"):
+                cache_path = self._cache_path(request["system_message"], request["user_message"],
+                                              request.get("response_format"))
+                if cache_path.is_file():
+                    responses[request["custom_id"]] = cache_path.read_text(encoding="utf-8")
+                    continue
+                cache_paths[request["custom_id"]] = cache_path
+            pending.append(request)
+
+        logging.info("Batch requests: %d cached, %d to submit", len(responses), len(pending))
+        if not pending:
+            return responses
+
+        batch_id = await self.submit_batch(pending)
+        batch_responses = await self.await_batch(batch_id, poll_interval)
+        for custom_id, response in batch_responses.items():
+            # Like stream_items, only cache responses that parsed as JSON
+            if custom_id in cache_paths and _is_json(response):
+                self._write_cache(cache_paths[custom_id], response)
+        responses.update(batch_responses)
+        return responses
+
+
+def _is_json(text: str) -> bool:
+    """
+    Whether a response is a complete, valid JSON document.
+    """
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def _log_prompt(system_message: str, user_message: str) -> None:
+    """
+    Log a short summary of a prompt; the full messages are only logged at DEBUG level.
+    """
+    logging.info("User Message: %d chars, sha256 %s", len(user_message),
+                 hashlib.sha256(user_message.encode()).hexdigest()[:12])
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("System Message: %s", system_message)
+        logging.debug("User Message: %s", user_message)
+
+
+def _request_args(temperature: Optional[float], response_format: Optional[dict]) -> dict:
+    """
+    Build the optional keyword arguments for chat.completions.create.
+    """
+    extra_args = {}
+    if temperature is not None:
+        extra_args["temperature"] = temperature
+    if response_format is not None:
+        extra_args["response_format"] = response_format
+    return extra_args
+
+
+async def _iter_text(text: str) -> AsyncIterator[str]:
+    """
+    Wrap a complete string as a single-piece async text stream.
+    """
+    yield text
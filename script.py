@@ -1,6 +1,10 @@
+import asyncio
+import hashlib
 import logging
-import json
-from typing import List, Optional
+import ijson
+import msgspec
+import os
+from typing import AsyncIterator, Dict, List, Optional
 from my_notion_client import NotionClientWrapper
 from my_openai import OpenAIClient
 
@@ -8,25 +12,161 @@ from my_openai import OpenAIClient
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Number of ideas sent to the model per evaluation request
+EVAL_SHARD_SIZE = 3
+# Maximum number of evaluation requests in flight at once (RPM headroom)
+EVAL_MAX_CONCURRENCY = 4
 
-class IdeaItem:
+
+def _json_schema_format(name: str, properties: dict) -> dict:
+    """
+    Build a strict structured-output response format for an object schema.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def _array_of_objects(properties: dict) -> dict:
+    """
+    Build a strict JSON schema for an array of objects with the given properties.
+    """
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        },
+    }
+
+
+# Structured-output formats; structured outputs require an object at the root
+_IDEAS_FORMAT = _json_schema_format("ideas", {
+    "ideas": _array_of_objects({
+        "title": {"type": "string"},
+        "description": {"type": "string"},
+    }),
+})
+_RATINGS_FORMAT = _json_schema_format("ratings", {
+    "ratings": _array_of_objects({
+        "rating": {"type": "string", "enum": ["Good enough", "Needs improvement"]},
+        "reason": {"type": "string"},
+    }),
+})
+_THEMES_FORMAT = _json_schema_format("themes", {
+    "themes": _array_of_objects({
+        "name": {"type": "string"},
+        "titles": {"type": "array", "items": {"type": "string"}},
+    }),
+})
+
+# Prompts are module-level constants so identical requests produce
+# byte-identical prompts (and therefore hit the response cache)
+_QUESTION = "How might we use digital tools to help people build trust and express emotions in romantic relationships?"
+
+_GENERATION_SYSTEM_MESSAGE = "You are a helpful assistant that excels in generating ideas and brainstorming."
+
+# Prompt to generate 24 ideas
+_GENERATION_PROMPT = f"""
+Generate 24 creative ideas to address the following question:
+"{_QUESTION}"
+
+Each idea must be an object with:
+- "title": Short descriptive title
+- "description": A one or two sentence explanation of the idea
+
+Return exactly 24 objects in the "ideas" array of a JSON object, for example:
+{{
+  "ideas": [
+    {{
+      "title": "Idea Title 1",
+      "description": "A short description."
+    }},
+    ...
+  ]
+}}
+"""
+
+_IMPROVEMENT_PROMPT_TMPL = """
+You are given a list of ideas that need improvement to be more creative, practical,
+and relevant. Each idea has "title" and "description".
+
+You are also provided examples of ideas rated "Good enough". Use these examples
+as inspiration when improving the weaker ideas.
+
+Good enough ideas:
+{good_ideas_json}
+
+Ideas to improve:
+{weak_ideas_json}
+
+Return the improved ideas in the "ideas" array of a JSON object,
+each with "title" and "description".
+"""
+
+_EVAL_SYSTEM_MESSAGE = "You are a helpful assistant that evaluates the quality of brainstorming ideas."
+
+_EVAL_PROMPT_TMPL = """
+You are given a list of ideas, each with a "title" and a "description".
+For each idea, evaluate its creativity, practicality, and relevance.
+
+Return a JSON object with a "ratings" array containing, in the same order
+as the ideas, one object per idea with:
+- "rating": "Good enough" or "Needs improvement"
+- "reason": A short explanation of why it got that rating
+
+Ideas:
+{ideas_json}
+"""
+
+_CATEGORIZATION_SYSTEM_MESSAGE = "You are a helpful assistant that excels at grouping ideas into relevant themes."
+
+_CATEGORIZATION_PROMPT_TMPL = """
+You are given a list of ideas, each with a "title" and "description".
+Your task is to sort them into 3–5 relevant themes or categories.
+
+Return the result as a JSON object with a "themes" array, where each theme
+has a "name" and the "titles" of the ideas that belong to it.
+
+Ideas:
+{ideas_json}
+"""
+
+
+class IdeaItem(msgspec.Struct):
     """
-    A Python class to store a brainstorming idea with title, description, 
+    A struct to store a brainstorming idea with title, description, 
     and an optional rating (e.g., "Good enough" or "Needs improvement").
     """
+    title: str
+    description: str
+    rating: Optional[str] = None
+
 
-    def __init__(self, title: str, description: str, rating: Optional[str] = None):
-        self.title = title
-        self.description = description
-        self.rating = rating
+class _Theme(msgspec.Struct):
+    name: str
+    titles: List[str]
 
-    def __repr__(self):
-        return f"IdeaItem(title={self.title!r}, description={self.description!r}, rating={self.rating!r})"
 
+class _Categorization(msgspec.Struct):
+    themes: List[_Theme]
 
-def parse_ideas(json_ideas: list) -> List[IdeaItem]:
+
+async def parse_ideas(json_ideas: AsyncIterator[dict]) -> List[IdeaItem]:
     """
-    Convert a JSON list of idea dicts into a list of IdeaItem objects.
+    Build IdeaItem objects from a stream of idea dicts as they arrive.
 
     Expected JSON format of each idea:
       {
@@ -35,115 +175,186 @@ def parse_ideas(json_ideas: list) -> List[IdeaItem]:
       }
 
     Args:
-        json_ideas (list): A list of dictionaries from the model response.
+        json_ideas (AsyncIterator[dict]): The streamed elements of the model response.
 
     Returns:
         list: A list of IdeaItem objects with title and description set.
+
+    Raises:
+        ijson.JSONError: If the response isn't a valid JSON array.
+        msgspec.ValidationError: If an element isn't a valid idea.
     """
-    idea_items = []
-    for idea_dict in json_ideas:
-        title = idea_dict.get("title", "")
-        description = idea_dict.get("description", "")
-        idea_items.append(IdeaItem(title, description))
-    return idea_items
+    return [msgspec.convert(idea_dict, IdeaItem) async for idea_dict in json_ideas]
 
 
-def ideas_to_json(ideas: List[IdeaItem]) -> list:
+def _idea_key(idea: IdeaItem) -> str:
     """
-    Convert a list of IdeaItem objects to a JSON-serializable list of dicts.
+    Return a key identifying an idea by its content.
+    """
+    return hashlib.sha256(f"{idea.title}\x1f{idea.description}".encode()).hexdigest()
+
+
+def ideas_to_json(ideas: List[IdeaItem]) -> str:
+    """
+    Encode a list of IdeaItem objects as a compact JSON string for use in prompts.
+    Whitespace is left out since it only adds prompt tokens.
 
     Args:
         ideas (list): A list of IdeaItem objects.
 
     Returns:
-        list: A list of dictionaries (title, description).
+        str: A JSON array of objects (title, description).
     """
-    return [{"title": idea.title, "description": idea.description} for idea in ideas]
+    return msgspec.json.encode(
+        [{"title": idea.title, "description": idea.description} for idea in ideas]).decode()
 
 
-def evaluate_ideas(openai_client: OpenAIClient, ideas: List[IdeaItem]) -> List[bool]:
+def _evaluation_prompt(shard: List[IdeaItem]) -> str:
     """
-    Send the ideas to the model for evaluation. Each idea gets a rating 
-    ("Good enough" or "Needs improvement") and a reason.
+    Build the evaluation prompt for a shard of ideas.
+    """
+    # Convert IdeaItem objects to JSON for the prompt
+    return _EVAL_PROMPT_TMPL.format_map({"ideas_json": ideas_to_json(shard)})
 
-    The function then updates each IdeaItem's 'rating' attribute 
-    and returns a list of booleans indicating if each idea is "Good enough".
+
+def _pad_ratings(shard: List[IdeaItem], ratings_data: list) -> list:
+    """
+    Pad missing verdicts with None so the flattened results stay aligned with
+    the ideas, while telling them apart from verdicts the model returned.
+    """
+    missing = len(shard) - len(ratings_data)
+    return ratings_data[:len(shard)] + [None] * missing
+
+
+async def _evaluate_shard(openai_client: OpenAIClient, shard: List[IdeaItem],
+                          semaphore: asyncio.Semaphore) -> list:
+    """
+    Evaluate a single shard of ideas with one model call.
 
     Args:
         openai_client (OpenAIClient): The OpenAI client instance.
-        ideas (list[IdeaItem]): A list of ideas to evaluate.
+        shard (list[IdeaItem]): The ideas to evaluate in this call.
+        semaphore (asyncio.Semaphore): Limits the number of concurrent requests.
 
     Returns:
-        list[bool]: For each idea, True if "Good enough", False if "Needs improvement".
+        list: One dict with "rating" and "reason" per idea in the shard,
+            or None for ideas the model returned no verdict for.
     """
-    system_message = "You are a helpful assistant that evaluates the quality of brainstorming ideas."
-    # Convert IdeaItem objects to JSON for the prompt
-    ideas_json = ideas_to_json(ideas)
-
-    evaluation_prompt = f"""
-    You are given a list of ideas, each with a "title" and a "description".
-    For each idea, evaluate its creativity, practicality, and relevance.
+    # Parse the verdicts as they are streamed, keeping any received before an error
+    ratings_data = []
+    async with semaphore:
+        try:
+            async for rating_obj in openai_client.stream_items(
+                    _EVAL_SYSTEM_MESSAGE, _evaluation_prompt(shard), temperature=0,
+                    response_format=_RATINGS_FORMAT, prefix="ratings.item"):
+                ratings_data.append(rating_obj)
+        except ijson.JSONError:
+            logging.error(
+                "Failed to parse evaluation response. Marking remaining ideas as Needs improvement.")
+
+    return _pad_ratings(shard, ratings_data)
+
+
+async def _evaluate_shards_batch(openai_client: OpenAIClient,
+                                 shards: List[List[IdeaItem]]) -> List[list]:
+    """
+    Evaluate all shards in a single OpenAI batch and wait for it to complete.
+    Shards whose evaluation is already cached aren't submitted.
 
-    Return a JSON array of objects, each with:
-    - "rating": "Good enough" or "Needs improvement"
-    - "reason": A short explanation of why it got that rating
+    Args:
+        openai_client (OpenAIClient): The OpenAI client instance.
+        shards (list[list[IdeaItem]]): The shards of ideas to evaluate.
 
-    Ideas:
-    {json.dumps(ideas_json, ensure_ascii=False, indent=2)}
+    Returns:
+        list[list]: For each shard, one dict with "rating" and "reason" per idea,
+            or None for ideas the model returned no verdict for.
     """
+    responses = await openai_client.batch_query([
+        {
+            "custom_id": f"eval-{idx}",
+            "system_message": _EVAL_SYSTEM_MESSAGE,
+            "user_message": _evaluation_prompt(shard),
+            "temperature": 0,
+            "response_format": _RATINGS_FORMAT,
+        }
+        for idx, shard in enumerate(shards)
+    ])
+
+    results = []
+    for idx, shard in enumerate(shards):
+        ratings_data = []
+        if f"eval-{idx}" not in responses:
+            logging.error(
+                f"No batch response for eval-{idx}. Marking shard as Needs improvement.")
+        else:
+            try:
+                ratings_data = msgspec.json.decode(
+                    responses[f"eval-{idx}"], type=dict).get("ratings", [])
+            except msgspec.DecodeError:
+                logging.error(
+                    "Failed to parse evaluation response. Marking shard as Needs improvement.")
+        results.append(_pad_ratings(shard, ratings_data))
+    return results
 
-    logging.info("Evaluating the quality of ideas...")
-    evaluation_response = openai_client.query(
-        system_message, evaluation_prompt)
-    # Parse the response
-    try:
-        ratings_data = json.loads(clean_json_response(evaluation_response))
-    except json.JSONDecodeError:
-        logging.error(
-            "Failed to parse evaluation response. Marking all as Needs improvement.")
-        # Mark all as "Needs improvement"
-        for idea in ideas:
-            idea.rating = "Needs improvement"
-        return [False] * len(ideas)
-
-    # ratings_data should be an array of objects with "rating" and "reason"
-    bool_results = []
-    for idea_item, rating_obj in zip(ideas, ratings_data):
-        rating = rating_obj.get("rating", "Needs improvement")
-        reason = rating_obj.get("reason", "")
-        idea_item.rating = rating  # store the rating in the idea object
-
-        is_good = (rating == "Good enough")
-        bool_results.append(is_good)
-
-        # Log out the reasoning for each idea
-        logging.info(
-            f"Idea: {idea_item.title}\n"
-            f"Rating: {rating}\n"
-            f"Reason: {reason}\n"
-        )
 
-    return bool_results
+async def evaluate_ideas(openai_client: OpenAIClient,
+                         ideas: List[IdeaItem]) -> List[Optional[bool]]:
+    """
+    Send the ideas to the model for evaluation. Each idea gets a rating 
+    ("Good enough" or "Needs improvement") and a reason.
 
+    The ideas are split into shards of EVAL_SHARD_SIZE which are evaluated
+    concurrently, at most EVAL_MAX_CONCURRENCY requests at a time. If the
+    IDEAGEN_BATCH environment variable is "1", the shards are instead submitted
+    as one OpenAI batch, which is cheaper but can take much longer.
 
-def clean_json_response(response: str) -> str:
-    """
-    Removes enclosing triple backticks and language hints (e.g., ```json) from a model response.
+    The function then updates each IdeaItem's 'rating' attribute 
+    and returns a list of booleans indicating if each idea is "Good enough".
+    Ideas without a verdict (e.g. because a response failed to parse) are
+    rated "Needs improvement" and reported as None.
 
     Args:
-        response (str): The raw string response from the model.
+        openai_client (OpenAIClient): The OpenAI client instance.
+        ideas (list[IdeaItem]): A list of ideas to evaluate.
 
     Returns:
-        str: The cleaned string, ready for JSON parsing.
+        list[Optional[bool]]: For each idea, True if "Good enough", False if
+            "Needs improvement", None if the model returned no verdict.
     """
-    if response.startswith("```json") and response.endswith("```"):
-        return response[7:-3].strip()  # Remove ```json and ```
-    elif response.startswith("```") and response.endswith("```"):
-        return response[3:-3].strip()  # Remove ```
-    return response
+    logging.info("Evaluating the quality of ideas...")
+    shards = [ideas[i:i + EVAL_SHARD_SIZE]
+              for i in range(0, len(ideas), EVAL_SHARD_SIZE)]
+    if os.environ.get("IDEAGEN_BATCH") == "1":
+        results = await _evaluate_shards_batch(openai_client, shards)
+    else:
+        semaphore = asyncio.Semaphore(EVAL_MAX_CONCURRENCY)
+        results = await asyncio.gather(
+            *[_evaluate_shard(openai_client, shard, semaphore) for shard in shards])
+    ratings_data = [rating_obj for shard_result in results for rating_obj in shard_result]
 
+    # ratings_data should be an array of objects with "rating" and "reason"
+    def _apply_rating(idea_item: IdeaItem, rating_obj: Optional[dict]) -> Optional[bool]:
+        if rating_obj is None:
+            idea_item.rating = "Needs improvement"
+            return None
+        rating = idea_item.rating = rating_obj.get("rating", "Needs improvement")
+        return rating == "Good enough"
+
+    bool_results = [_apply_rating(idea_item, rating_obj)
+                    for idea_item, rating_obj in zip(ideas, ratings_data)]
+
+    # Log out the reasoning for all ideas in one record
+    logging.info("\n".join(
+        f"Idea: {idea_item.title}\n"
+        f"Rating: {idea_item.rating}\n"
+        f"Reason: {rating_obj.get('reason', '') if rating_obj else 'No verdict returned'}\n"
+        for idea_item, rating_obj in zip(ideas, ratings_data)
+    ))
+
+    return bool_results
 
-def generate_ideas(openai_client: OpenAIClient) -> List[IdeaItem]:
+
+async def generate_ideas(openai_client: OpenAIClient) -> List[IdeaItem]:
     """
     Generates 24 ideas, evaluates them, improves the weak ones, 
     and repeats until all are 'Good enough' or 5 attempts have passed.
@@ -151,28 +362,6 @@ def generate_ideas(openai_client: OpenAIClient) -> List[IdeaItem]:
     Returns:
         list[IdeaItem]: The final list of 24 ideas (each with title, description, rating).
     """
-    system_message = "You are a helpful assistant that excels in generating ideas and brainstorming."
-    question = "How might we use digital tools to help people build trust and express emotions in romantic relationships?"
-
-    # Prompt to generate 24 ideas
-    generation_prompt = f"""
-    Generate 24 creative ideas in a JSON array to address the following question:
-    "{question}"
-
-    Each idea must be an object with:
-    - "title": Short descriptive title
-    - "description": A one or two sentence explanation of the idea
-
-    Return exactly 24 objects in a valid JSON list, for example:
-    [
-      {{
-        "title": "Idea Title 1",
-        "description": "A short description."
-      }},
-      ...
-    ]
-    """
-
     max_attempts = 5
     attempts = 0
 
@@ -180,6 +369,13 @@ def generate_ideas(openai_client: OpenAIClient) -> List[IdeaItem]:
     good_enough_ideas: List[IdeaItem] = []
     needs_improvement_ideas: List[IdeaItem] = []
 
+    # Verdicts of ideas evaluated so far, so unchanged ideas aren't evaluated again
+    verdict_cache: Dict[str, bool] = {}
+
+    # good_enough_ideas only ever grows, so its JSON is re-encoded only when it does
+    good_ideas_json = ""
+    good_ideas_len = -1
+
     while attempts < max_attempts:
         attempts += 1
         logging.info(f"--- Attempt {attempts} of {max_attempts} ---")
@@ -187,27 +383,36 @@ def generate_ideas(openai_client: OpenAIClient) -> List[IdeaItem]:
         # 1) Generate initial ideas if no ideas exist
         if not good_enough_ideas and not needs_improvement_ideas:
             logging.info("Generating 24 initial ideas...")
-            raw_generation_response = openai_client.query(
-                system_message, generation_prompt)
             try:
-                json_list = json.loads(
-                    clean_json_response(raw_generation_response))
-                all_ideas = parse_ideas(json_list)
+                all_ideas = await parse_ideas(openai_client.stream_items(
+                    _GENERATION_SYSTEM_MESSAGE, _GENERATION_PROMPT,
+                    response_format=_IDEAS_FORMAT, prefix="ideas.item"))
                 needs_improvement_ideas.extend(all_ideas)
-            except json.JSONDecodeError:
+            except (ijson.JSONError, msgspec.ValidationError):
                 logging.error("Failed to parse initial ideas. Retrying...")
                 continue
 
         # 2) Evaluate the ideas in the `needs_improvement_ideas` list
         if needs_improvement_ideas:
-            logging.info(f"Evaluating {len(needs_improvement_ideas)} ideas...")
-            evaluation_results = evaluate_ideas(
-                openai_client, needs_improvement_ideas)
+            idea_keys = [_idea_key(idea) for idea in needs_improvement_ideas]
+            unknown = [(idea, key) for idea, key in zip(needs_improvement_ideas, idea_keys)
+                       if key not in verdict_cache]
+            logging.info(
+                f"Evaluating {len(unknown)} ideas "
+                f"({len(needs_improvement_ideas) - len(unknown)} unchanged)...")
+            if unknown:
+                evaluation_results = await evaluate_ideas(
+                    openai_client, [idea for idea, _ in unknown])
+                # Only cache verdicts the model actually returned, so ideas
+                # without one are evaluated again next round
+                for (_, key), is_good in zip(unknown, evaluation_results):
+                    if is_good is not None:
+                        verdict_cache[key] = is_good
 
             # Separate ideas into good enough and needs improvement
-            for idx, is_good in enumerate(evaluation_results):
-                idea = needs_improvement_ideas[idx]
-                if is_good:
+            for idea, key in zip(needs_improvement_ideas, idea_keys):
+                if verdict_cache.get(key, False):
+                    idea.rating = "Good enough"
                     good_enough_ideas.append(idea)
                 else:
                     idea.rating = "Needs improvement"
@@ -220,34 +425,21 @@ def generate_ideas(openai_client: OpenAIClient) -> List[IdeaItem]:
         if needs_improvement_ideas:
             logging.info(f"Improving {len(needs_improvement_ideas)} ideas...")
             weak_ideas_json = ideas_to_json(needs_improvement_ideas)
-            good_ideas_json = ideas_to_json(good_enough_ideas)
-
-            improvement_prompt = f"""
-            You are given a list of ideas that need improvement to be more creative, practical,
-            and relevant. Each idea has "title" and "description".
-
-            You are also provided examples of ideas rated "Good enough". Use these examples
-            as inspiration when improving the weaker ideas.
+            if len(good_enough_ideas) != good_ideas_len:
+                good_ideas_json = ideas_to_json(good_enough_ideas)
+                good_ideas_len = len(good_enough_ideas)
 
-            Good enough ideas:
-            {json.dumps(good_ideas_json, ensure_ascii=False, indent=2)}
+            improvement_prompt = _IMPROVEMENT_PROMPT_TMPL.format_map(
+                {"good_ideas_json": good_ideas_json, "weak_ideas_json": weak_ideas_json})
 
-            Ideas to improve:
-            {json.dumps(weak_ideas_json, ensure_ascii=False, indent=2)}
-
-            Return the improved ideas in the same JSON structure.
-            """
-
-            improve_response = openai_client.query(
-                system_message, improvement_prompt)
             try:
-                improved_list = json.loads(
-                    clean_json_response(improve_response))
-                improved_ideas = parse_ideas(improved_list)
+                improved_ideas = await parse_ideas(openai_client.stream_items(
+                    _GENERATION_SYSTEM_MESSAGE, improvement_prompt,
+                    response_format=_IDEAS_FORMAT, prefix="ideas.item"))
 
                 # Replace the weak ideas with the improved ones
                 needs_improvement_ideas = improved_ideas
-            except json.JSONDecodeError:
+            except (ijson.JSONError, msgspec.ValidationError):
                 logging.error("Failed to parse improved ideas. Retrying...")
                 continue
 
@@ -261,7 +453,7 @@ def generate_ideas(openai_client: OpenAIClient) -> List[IdeaItem]:
     return good_enough_ideas + needs_improvement_ideas
 
 
-def categorize_ideas(openai_client: OpenAIClient, ideas: List[IdeaItem]) -> dict:
+async def categorize_ideas(openai_client: OpenAIClient, ideas: List[IdeaItem]) -> dict:
     """
     Categorize the ideas into 3–5 relevant themes using the model.
 
@@ -272,147 +464,149 @@ def categorize_ideas(openai_client: OpenAIClient, ideas: List[IdeaItem]) -> dict
     Returns:
         dict: A dictionary where keys are theme names, and values are lists of IdeaItem titles.
     """
-    system_message = "You are a helpful assistant that excels at grouping ideas into relevant themes."
-    ideas_json = ideas_to_json(ideas)
-
-    categorization_prompt = f"""
-    You are given a list of ideas, each with a "title" and "description".
-    Your task is to sort them into 3–5 relevant themes or categories.
-
-    Return the result as a JSON object where the keys are the theme names,
-    and the values are lists of idea titles that belong to each theme.
-
-    Ideas:
-    {json.dumps(ideas_json, ensure_ascii=False, indent=2)}
-    """
+    categorization_prompt = _CATEGORIZATION_PROMPT_TMPL.format_map(
+        {"ideas_json": ideas_to_json(ideas)})
 
     logging.info("Categorizing ideas into themes...")
-    categorization_response = openai_client.query(
-        system_message, categorization_prompt)
+    categorization_response = await openai_client.query(
+        _CATEGORIZATION_SYSTEM_MESSAGE, categorization_prompt, temperature=0,
+        response_format=_THEMES_FORMAT)
 
     try:
-        categories = json.loads(clean_json_response(categorization_response))
-        logging.info(f"Categorization result:\n{json.dumps(
-            categories, indent=2, ensure_ascii=False)}")
+        categorization = msgspec.json.decode(
+            categorization_response, type=_Categorization)
+        categories = {theme.name: theme.titles for theme in categorization.themes}
+        categories_text = msgspec.json.format(
+            msgspec.json.encode(categories), indent=2).decode()
+        logging.info(f"Categorization result:\n{categories_text}")
         return categories
-    except json.JSONDecodeError:
+    except msgspec.DecodeError:
         logging.error(
             "Failed to parse categorization response. Returning an empty dictionary.")
         return {}
 
 
-def main():
+async def main():
     openai_client = OpenAIClient()
-
-    # Generate and improve ideas
-    final_ideas = generate_ideas(openai_client)
-
-    # Categorize ideas into themes
-    categories = categorize_ideas(openai_client, final_ideas)
-
-    # Notion setup
-    my_notion_client = NotionClientWrapper()
-
-    # Append introductory section with GitHub link
-    github_message_block = {
-        "object": "block",
-        "type": "paragraph",
-        "paragraph": {
-            "rich_text": [
-                {
-                    "type": "text",
-                    "text": {"content": "The following section is entirely AI-generated using this tool: "},
-                    "annotations": {"italic": True},
-                },
-                {
-                    "type": "text",
-                    "text": {"content": "AI Idea Generator", "link": {"url": "https://github.com/bjarkividars/AI-Idea-Generator"}},
-                    "annotations": {"italic": True},
-                },
-                {
-                    "type": "text",
-                    "text": {"content": "."},
-                    "annotations": {"italic": True},
-                },
-            ]
-        },
-    }
-    my_notion_client.append_custom_blocks_to_page(
-        [github_message_block]
-    )
-
-    # Append final ideas
-    ideas_heading = {
-        "object": "block",
-        "type": "heading_3",
-        "heading_3": {"rich_text": [{"type": "text", "text": {"content": "Generated Ideas"}}]},
-    }
-    my_notion_client.append_custom_blocks_to_page([ideas_heading])
-
-    # Create a bulleted list for the ideas
-    idea_blocks = [
-        {
-            "object": "block",
-            "type": "bulleted_list_item",
-            "bulleted_list_item": {
-                "rich_text": [
-                    {
-                        "type": "text",
-                        "text": {"content": f"{idea.title}: "},
-                        "annotations": {"bold": True},  # Make the title bold
-                    },
-                    {
-                        "type": "text",
-                        # Add the description
-                        "text": {"content": idea.description},
+    try:
+        # Notion setup, before any work so a misconfiguration fails early
+        my_notion_client = NotionClientWrapper()
+        try:
+            # Generate and improve ideas
+            final_ideas = await generate_ideas(openai_client)
+
+            # Categorize ideas into themes while the ideas are uploaded to Notion
+            categorize_task = asyncio.create_task(
+                categorize_ideas(openai_client, final_ideas))
+            try:
+                # Append introductory section with GitHub link
+                github_message_block = {
+                    "object": "block",
+                    "type": "paragraph",
+                    "paragraph": {
+                        "rich_text": [
+                            {
+                                "type": "text",
+                                "text": {"content": "The following section is entirely AI-generated using this tool: "},
+                                "annotations": {"italic": True},
+                            },
+                            {
+                                "type": "text",
+                                "text": {"content": "AI Idea Generator", "link": {"url": "https://github.com/bjarkividars/AI-Idea-Generator"}},
+                                "annotations": {"italic": True},
+                            },
+                            {
+                                "type": "text",
+                                "text": {"content": "."},
+                                "annotations": {"italic": True},
+                            },
+                        ]
                     },
-                ]
-            },
-        }
-        for idea in final_ideas
-    ]
-    my_notion_client.append_custom_blocks_to_page(idea_blocks)
-
-    # Append affinity diagram
-    affinity_heading = {
-        "object": "block",
-        "type": "paragraph",
-        "paragraph": {
-            "rich_text": [
-                {
-                    "type": "text",
-                    "text": {"content": "Affinity Diagram (Themes)"},
-                    "annotations": {"bold": True},
                 }
-            ]
-        },
-    }
-    my_notion_client.append_custom_blocks_to_page([affinity_heading])
 
-    for theme, titles in categories.items():
-        theme_heading = {
-            "object": "block",
-            "type": "heading_3",
-            "heading_3": {"rich_text": [{"type": "text", "text": {"content": theme}}]},
-        }
-        my_notion_client.append_custom_blocks_to_page([theme_heading])
+                # Append final ideas
+                ideas_heading = {
+                    "object": "block",
+                    "type": "heading_3",
+                    "heading_3": {"rich_text": [{"type": "text", "text": {"content": "Generated Ideas"}}]},
+                }
 
-        theme_blocks = [
-            {
+                # Create a bulleted list for the ideas
+                idea_blocks = [
+                    {
+                        "object": "block",
+                        "type": "bulleted_list_item",
+                        "bulleted_list_item": {
+                            "rich_text": [
+                                {
+                                    "type": "text",
+                                    "text": {"content": f"{idea.title}: "},
+                                    "annotations": {"bold": True},  # Make the title bold
+                                },
+                                {
+                                    "type": "text",
+                                    # Add the description
+                                    "text": {"content": idea.description},
+                                },
+                            ]
+                        },
+                    }
+                    for idea in final_ideas
+                ]
+                # Blocks are appended in order, so they're sent in as few requests as possible
+                await my_notion_client.append_custom_blocks_to_page(
+                    [github_message_block, ideas_heading] + idea_blocks)
+
+                categories = await categorize_task
+            finally:
+                # Make sure the task never outlives main, and its error is retrieved
+                categorize_task.cancel()
+                await asyncio.gather(categorize_task, return_exceptions=True)
+
+            # Append affinity diagram
+            affinity_heading = {
                 "object": "block",
-                "type": "bulleted_list_item",
-                "bulleted_list_item": {
+                "type": "paragraph",
+                "paragraph": {
                     "rich_text": [
-                        {"type": "text", "text": {"content": title}}
+                        {
+                            "type": "text",
+                            "text": {"content": "Affinity Diagram (Themes)"},
+                            "annotations": {"bold": True},
+                        }
                     ]
                 },
             }
-            for title in titles
-        ]
-        my_notion_client.append_custom_blocks_to_page(theme_blocks)
+            affinity_blocks = [affinity_heading]
+
+            for theme, titles in categories.items():
+                theme_heading = {
+                    "object": "block",
+                    "type": "heading_3",
+                    "heading_3": {"rich_text": [{"type": "text", "text": {"content": theme}}]},
+                }
+                theme_blocks = [
+                    {
+                        "object": "block",
+                        "type": "bulleted_list_item",
+                        "bulleted_list_item": {
+                            "rich_text": [
+                                {"type": "text", "text": {"content": title}}
+                            ]
+                        },
+                    }
+                    for title in titles
+                ]
+                affinity_blocks += [theme_heading] + theme_blocks
+
+            await my_notion_client.append_custom_blocks_to_page(affinity_blocks)
+        finally:
+            await my_notion_client.close()
+    finally:
+        await openai_client.close()
 
     print("Process completed and uploaded to Notion!")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())